@@ -35,6 +35,22 @@ Global Configuration
    Enabling instrumentation for resolvers will produce a ``graphql.resolve`` span for every graphql field.
    For complex graphql queries this could produce large traces.
 
+.. py:data:: ddtrace.config.graphql["full_error_format"]
+
+   By default the ``error.msg`` tag of graphql spans only contains the message of each ``GraphQLError``.
+   To also include the source locations of the errors set ``DD_TRACE_GRAPHQL_FULL_ERROR_FORMAT`` to True
+
+   Default: ``False``
+
+.. py:data:: ddtrace.config.graphql["suppress_nested_spans"]
+
+   To skip the ``graphql.parse`` and ``graphql.validate`` spans of queries traced by a ``graphql.request`` span
+   set ``DD_TRACE_GRAPHQL_SUPPRESS_NESTED_SPANS`` to True
+
+   Default: ``False``
+
+   Parse and validate calls made outside of ``graphql.graphql()`` are always traced.
+
 
 To configure the graphql integration using the
 ``Pin`` API::
@@ -1,5 +1,4 @@
 import os
-import re
 import sys
 from typing import TYPE_CHECKING
 
@@ -9,6 +8,7 @@ if TYPE_CHECKING:  # pragma: no cover
     from typing import Dict
     from typing import Iterable
     from typing import List
+    from typing import Optional
     from typing import Tuple
     from typing import Union
 
@@ -25,6 +25,7 @@ from ddtrace.constants import ANALYTICS_SAMPLE_RATE_KEY
 from ddtrace.constants import ERROR_MSG
 from ddtrace.constants import ERROR_TYPE
 from ddtrace.constants import SPAN_MEASURED_KEY
+from ddtrace.internal import forksafe
 from ddtrace.internal.compat import stringify
 from ddtrace.internal.utils import ArgumentError
 from ddtrace.internal.utils import get_argument_value
@@ -34,77 +35,133 @@ from ddtrace.internal.utils.version import parse_version
 from ddtrace.internal.wrapping import unwrap
 from ddtrace.internal.wrapping import wrap
 from ddtrace.pin import Pin
+from ddtrace.pin import _DD_PIN_NAME
 
 from .. import trace_utils
 from ...ext import SpanTypes
 
 
 _graphql_version = parse_version(getattr(graphql, "__version__"))
+_IS_GRAPHQL_V2 = _graphql_version < (3, 0)
 
-if _graphql_version < (3, 0):
+if _IS_GRAPHQL_V2:
     from graphql.language.ast import Document
+
+    _EXECUTE_DOCUMENT_ARG = "document_ast"
 else:
     from graphql.language.ast import DocumentNode as Document
 
+    _EXECUTE_DOCUMENT_ARG = "document"
+
+# middleware is the 10th argument of graphql.execute(..) in version 3.2+
+_EXECUTE_MIDDLEWARE_ARG_POS = 9 if _graphql_version >= (3, 2) else 8
+
 
 config._add(
     "graphql",
     dict(
         _default_service="graphql",
         resolvers_enabled=asbool(os.getenv("DD_TRACE_GRAPHQL_RESOLVERS_ENABLED", default=False)),
+        full_error_format=asbool(os.getenv("DD_TRACE_GRAPHQL_FULL_ERROR_FORMAT", default=False)),
+        suppress_nested_spans=asbool(os.getenv("DD_TRACE_GRAPHQL_SUPPRESS_NESTED_SPANS", default=False)),
     ),
 )
 
+_GRAPHQL_PARSE_SPAN_NAME = "graphql.parse"
+_GRAPHQL_VALIDATE_SPAN_NAME = "graphql.validate"
+_GRAPHQL_EXECUTE_SPAN_NAME = "graphql.execute"
+_GRAPHQL_REQUEST_SPAN_NAME = "graphql.request"
+_GRAPHQL_RESOLVE_SPAN_NAME = "graphql.resolve"
+
 _GRAPHQL_SOURCE = "graphql.source"
 _GRAPHQL_OPERATION_TYPE = "graphql.operation.type"
 _GRAPHQL_OPERATION_NAME = "graphql.operation.name"
+_GRAPHQL_ERROR_TYPE = "%s.%s" % (GraphQLError.__module__, GraphQLError.__name__)
+
+
+# serializes patch() and unpatch() so concurrent calls can not wrap the graphql functions twice
+_patch_lock = forksafe.Lock()
 
 
 def patch():
-    if getattr(graphql, "_datadog_patch", False):
-        return
-    setattr(graphql, "_datadog_patch", True)
-    Pin().onto(graphql)
+    with _patch_lock:
+        if getattr(graphql, "_datadog_patch", False):
+            return
+        setattr(graphql, "_datadog_patch", True)
+        Pin().onto(graphql)
 
-    for module_str, func_name, wrapper in _get_patching_candidates():
-        _update_patching(wrap, module_str, func_name, wrapper)
+        for func, wrapper in _get_patching_candidates():
+            wrap(func, wrapper)
 
 
 def unpatch():
-    if not getattr(graphql, "_datadog_patch", False) or _graphql_version < (2, 0):
-        return
+    with _patch_lock:
+        if not getattr(graphql, "_datadog_patch", False) or _graphql_version < (2, 0):
+            return
+
+        for func, wrapper in _get_patching_candidates():
+            unwrap(func, wrapper)
 
-    for module_str, func_name, wrapper in _get_patching_candidates():
-        _update_patching(unwrap, module_str, func_name, wrapper)
+        setattr(graphql, "_datadog_patch", False)
 
-    setattr(graphql, "_datadog_patch", False)
+
+# resolved (function, wrapper) pairs, the patched functions are wrapped in place so they can be reused
+_PATCH_TARGETS = None  # type: Optional[List[Tuple[Callable, Callable]]]
 
 
 def _get_patching_candidates():
-    if _graphql_version < (3, 0):
-        return [
-            ("graphql.graphql", "execute_graphql", _traced_query),
-            ("graphql.language.parser", "parse", _traced_parse),
-            ("graphql.validation.validation", "validate", _traced_validate),
-            ("graphql.execution.executor", "execute", _traced_execute),
+    # type: () -> List[Tuple[Callable, Callable]]
+    global _PATCH_TARGETS
+
+    if _PATCH_TARGETS is None:
+        if _IS_GRAPHQL_V2:
+            candidates = [
+                ("graphql.graphql", "execute_graphql", _traced_query),
+                ("graphql.language.parser", "parse", _traced_parse),
+                ("graphql.validation.validation", "validate", _traced_validate),
+                ("graphql.execution.executor", "execute", _traced_execute),
+            ]
+        else:
+            candidates = [
+                ("graphql.graphql", "graphql_impl", _traced_query),
+                ("graphql.language.parser", "parse", _traced_parse),
+                ("graphql.validation.validate", "validate", _traced_validate),
+                ("graphql.execution.execute", "execute", _traced_execute),
+            ]
+        _PATCH_TARGETS = [
+            (getattr(sys.modules[module_str], func_name), wrapper) for module_str, func_name, wrapper in candidates
         ]
-    return [
-        ("graphql.graphql", "graphql_impl", _traced_query),
-        ("graphql.language.parser", "parse", _traced_parse),
-        ("graphql.validation.validate", "validate", _traced_validate),
-        ("graphql.execution.execute", "execute", _traced_execute),
-    ]
+    return _PATCH_TARGETS
 
 
-def _update_patching(operation, module_str, func_name, wrapper):
-    module = sys.modules[module_str]
-    func = getattr(module, func_name)
-    operation(func, wrapper)
+def _get_enabled_pin():
+    # type: () -> Optional[Pin]
+    """
+    Returns the pin attached to the graphql module if its tracer is enabled.
+    The pin is always set on the module itself so it is read directly instead
+    of going through Pin.get_from(), which handles pins inherited from classes.
+    """
+    pin = getattr(graphql, _DD_PIN_NAME, None)
+    if pin is None or not pin.tracer.enabled:
+        return None
+    return pin
+
+
+def _is_nested_in_graphql_request(pin):
+    # type: (Pin) -> bool
+    """
+    Returns True if nested parse and validate spans should be skipped because the
+    active span is a graphql.request span which already covers their execution.
+    """
+    if not config.graphql.suppress_nested_spans:
+        return False
+    active = pin.tracer.current_span()
+    return active is not None and active.name == _GRAPHQL_REQUEST_SPAN_NAME and active.span_type == SpanTypes.GRAPHQL
 
 
 def _traced_parse(func, args, kwargs):
-    pin = Pin.get_from(graphql)
-    if not pin or not pin.enabled():
+    pin = _get_enabled_pin()
+    if pin is None or _is_nested_in_graphql_request(pin):
         return func(*args, **kwargs)
 
     source = get_argument_value(args, kwargs, 0, "source")
@@ -112,7 +169,7 @@ def _traced_parse(func, args, kwargs):
     # If graphql.parse() is called outside graphql.graphql(), graphql.parse will
     # be a top level span. Therefore we must explicitly set the service name.
     with pin.tracer.trace(
-        name="graphql.parse",
+        name=_GRAPHQL_PARSE_SPAN_NAME,
         service=trace_utils.int_service(pin, config.graphql),
         span_type=SpanTypes.GRAPHQL,
     ) as span:
@@ -121,8 +178,8 @@ def _traced_parse(func, args, kwargs):
 
 
 def _traced_validate(func, args, kwargs):
-    pin = Pin.get_from(graphql)
-    if not pin or not pin.enabled():
+    pin = _get_enabled_pin()
+    if pin is None or _is_nested_in_graphql_request(pin):
         return func(*args, **kwargs)
 
     document = get_argument_value(args, kwargs, 1, "ast")
@@ -130,7 +187,7 @@ def _traced_validate(func, args, kwargs):
     # If graphql.validate() is called outside graphql.graphql(), graphql.validate will
     # be a top level span. Therefore we must explicitly set the service name.
     with pin.tracer.trace(
-        name="graphql.validate",
+        name=_GRAPHQL_VALIDATE_SPAN_NAME,
         service=trace_utils.int_service(pin, config.graphql),
         span_type=SpanTypes.GRAPHQL,
     ) as span:
@@ -141,23 +198,20 @@ def _traced_validate(func, args, kwargs):
 
 
 def _traced_execute(func, args, kwargs):
-    pin = Pin.get_from(graphql)
-    if not pin or not pin.enabled():
+    pin = _get_enabled_pin()
+    if pin is None:
         return func(*args, **kwargs)
 
     if config.graphql.resolvers_enabled:
         # patch resolvers
-        args, kwargs = _inject_trace_middleware_to_args(_resolver_middleware, args, kwargs)
+        args, kwargs = _inject_trace_middleware_to_args(_ResolverMiddleware(pin), args, kwargs)
 
     # set resource name
-    if _graphql_version < (3, 0):
-        document = get_argument_value(args, kwargs, 1, "document_ast")
-    else:
-        document = get_argument_value(args, kwargs, 1, "document")
+    document = get_argument_value(args, kwargs, 1, _EXECUTE_DOCUMENT_ARG)
     source_str = _get_source_str(document)
 
     with pin.tracer.trace(
-        name="graphql.execute",
+        name=_GRAPHQL_EXECUTE_SPAN_NAME,
         resource=source_str,
         service=trace_utils.int_service(pin, config.graphql),
         span_type=SpanTypes.GRAPHQL,
@@ -173,8 +227,8 @@ def _traced_execute(func, args, kwargs):
 
 
 def _traced_query(func, args, kwargs):
-    pin = Pin.get_from(graphql)
-    if not pin or not pin.enabled():
+    pin = _get_enabled_pin()
+    if pin is None:
         return func(*args, **kwargs)
 
     # set resource name
@@ -182,16 +236,16 @@ def _traced_query(func, args, kwargs):
     resource = _get_source_str(source)
 
     with pin.tracer.trace(
-        name="graphql.request",
+        name=_GRAPHQL_REQUEST_SPAN_NAME,
         resource=resource,
         service=trace_utils.int_service(pin, config.graphql),
         span_type=SpanTypes.GRAPHQL,
     ) as span:
         # mark span as measured and set sample rate
-        span.set_tag(SPAN_MEASURED_KEY)
+        span.set_metric(SPAN_MEASURED_KEY, 1)
         sample_rate = config.graphql.get_analytics_sample_rate()
         if sample_rate is not None:
-            span.set_tag(ANALYTICS_SAMPLE_RATE_KEY, sample_rate)
+            span.set_metric(ANALYTICS_SAMPLE_RATE_KEY, sample_rate)
 
         result = func(*args, **kwargs)
         if isinstance(result, ExecutionResult):
@@ -202,36 +256,41 @@ def _traced_query(func, args, kwargs):
         return result
 
 
-def _resolver_middleware(next_middleware, root, info, **args):
+class _ResolverMiddleware(object):
     """
     trace middleware which wraps the resolvers of graphql fields.
-    Note - graphql middlewares can not be a partial. It must be a class or a function.
+    Note - graphql middlewares can not be a partial or a callable object. They must be a function
+    or an object with a ``resolve`` method. An instance is created for each graphql.execute() call
+    so the pin is only looked up once per request instead of once per resolved field.
     """
-    pin = Pin.get_from(graphql)
-    if not pin or not pin.enabled():
-        return next_middleware(root, info, **args)
 
-    with pin.tracer.trace(
-        name="graphql.resolve",
-        resource=info.field_name,
-        span_type=SpanTypes.GRAPHQL,
-    ):
-        return next_middleware(root, info, **args)
+    __slots__ = ("_pin",)
+
+    def __init__(self, pin):
+        # type: (Pin) -> None
+        self._pin = pin
+
+    def resolve(self, next_middleware, root, info, **args):
+        tracer = self._pin.tracer
+        if not tracer.enabled:
+            return next_middleware(root, info, **args)
+
+        with tracer.trace(
+            name=_GRAPHQL_RESOLVE_SPAN_NAME,
+            resource=info.field_name,
+            span_type=SpanTypes.GRAPHQL,
+        ):
+            return next_middleware(root, info, **args)
 
 
 def _inject_trace_middleware_to_args(trace_middleware, args, kwargs):
-    # type: (Callable, Tuple, Dict) -> Tuple[Tuple, Dict]
+    # type: (_ResolverMiddleware, Tuple, Dict) -> Tuple[Tuple, Dict]
     """
     Adds a trace middleware to graphql.execute(..., middleware, ...)
     """
-    middlewares_arg = 8
-    if _graphql_version >= (3, 2):
-        # middleware is the 10th argument graphql.execute(..) version 3.2+
-        middlewares_arg = 9
-
     # get middlewares from args or kwargs
     try:
-        middlewares = get_argument_value(args, kwargs, middlewares_arg, "middleware") or []
+        middlewares = get_argument_value(args, kwargs, _EXECUTE_MIDDLEWARE_ARG_POS, "middleware")
         if isinstance(middlewares, MiddlewareManager):
             # First we must get the middlewares iterable from the MiddlewareManager then append
             # trace_middleware. For the trace_middleware to be called a new MiddlewareManager will
@@ -239,14 +298,30 @@ def _inject_trace_middleware_to_args(trace_middleware, args, kwargs):
             # https://github.com/graphql-python/graphql-core/blob/v3.2.1/src/graphql/execution/execute.py#L254
             middlewares = middlewares.middlewares  # type: Iterable
     except ArgumentError:
-        middlewares = []
+        middlewares = None
+
+    if middlewares is not None and not isinstance(middlewares, (list, tuple)):
+        # one-shot iterables (e.g. generators) can only be consumed once, replace them with a list
+        # so the middlewares are still passed to graphql.execute() after being inspected below
+        middlewares = list(middlewares)
+        args, kwargs = set_argument_value(args, kwargs, _EXECUTE_MIDDLEWARE_ARG_POS, "middleware", middlewares)
+
+    if middlewares and any(isinstance(middleware, _ResolverMiddleware) for middleware in middlewares):
+        # resolvers are already traced, e.g. the middlewares were forwarded from an outer traced execute
+        return args, kwargs
 
     # Note - graphql middlewares are called in reverse order
     # add trace_middleware to the end of the list to wrap the execution of resolver and all middlewares
-    middlewares = list(middlewares) + [trace_middleware]
+    if not middlewares:
+        middlewares = [trace_middleware]
+    elif isinstance(middlewares, list):
+        # copy the list, the caller's middlewares must not be mutated
+        middlewares = middlewares + [trace_middleware]
+    else:
+        middlewares = list(middlewares) + [trace_middleware]
 
     # update args and kwargs to contain trace_middleware
-    args, kwargs = set_argument_value(args, kwargs, middlewares_arg, "middleware", middlewares)
+    args, kwargs = set_argument_value(args, kwargs, _EXECUTE_MIDDLEWARE_ARG_POS, "middleware", middlewares)
     return args, kwargs
 
 
@@ -264,8 +339,9 @@ def _get_source_str(obj):
         source_str = obj.loc.source.body
     else:
         source_str = ""
-    # remove new lines, tabs and extra whitespace from source_str
-    return re.sub(r"\s+", " ", source_str).strip()
+    # remove new lines, tabs and extra whitespace from source_str. str.split() without
+    # a separator splits on runs of whitespace and drops leading and trailing whitespace
+    return " ".join(source_str.split())
 
 
 def _set_span_errors(errors, span):
@@ -275,9 +351,12 @@ def _set_span_errors(errors, span):
         return
 
     span.error = 1
-    exc_type_str = "%s.%s" % (GraphQLError.__module__, GraphQLError.__name__)
-    span.set_tag_str(ERROR_TYPE, exc_type_str)
-    error_msgs = "\n".join([stringify(error) for error in errors])
+    span.set_tag_str(ERROR_TYPE, _GRAPHQL_ERROR_TYPE)
+    if config.graphql.full_error_format:
+        # str(GraphQLError) includes the source locations of the error in graphql-core>=3
+        error_msgs = "\n".join(stringify(error) for error in errors)
+    else:
+        error_msgs = "\n".join(getattr(error, "message", None) or stringify(error) for error in errors)
     # Since we do not support adding and visualizing multiple tracebacks to one span
     # we will not set the error.stack tag on graphql spans. Setting only one traceback
     # could be misleading and might obfuscate errors.
@@ -290,7 +369,7 @@ def _set_span_operation_tags(span, document):
         return
 
     # operation_def.operation should never be None
-    if _graphql_version < (3, 0):
+    if _IS_GRAPHQL_V2:
         span.set_tag_str(_GRAPHQL_OPERATION_TYPE, operation_def.operation)
     else:
         # OperationDefinition.operation is an Enum in graphql-core>=3
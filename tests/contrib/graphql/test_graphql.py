@@ -1,10 +1,16 @@
 import graphql
 import pytest
 
+from ddtrace import Pin
 from ddtrace import tracer
+from ddtrace.constants import ERROR_MSG
 from ddtrace.contrib.graphql import patch
 from ddtrace.contrib.graphql import unpatch
+from ddtrace.contrib.graphql.patch import _ResolverMiddleware
 from ddtrace.contrib.graphql.patch import _graphql_version as graphql_version
+from ddtrace.internal.processor.stats import SpanStatsProcessorV06
+from ddtrace.sampler import RateSampler
+from tests.utils import DummyTracer
 from tests.utils import override_config
 from tests.utils import snapshot
 
@@ -16,6 +22,13 @@ def enable_graphql_patching():
     unpatch()
 
 
+@pytest.fixture
+def dummy_tracer():
+    dummy_tracer = DummyTracer()
+    Pin.override(graphql, tracer=dummy_tracer)
+    yield dummy_tracer
+
+
 @pytest.fixture
 def enable_graphql_resolvers():
     with override_config("graphql", dict(resolvers_enabled=True)):
@@ -71,6 +84,16 @@ async def test_graphql_with_traced_resolver(test_schema, test_source_str, snapsh
         assert result.data == {"hello": "friend"}
 
 
+@pytest.mark.asyncio
+async def test_graphql_suppress_nested_spans(test_schema, test_source_str, snapshot_context):
+    with override_config("graphql", dict(suppress_nested_spans=True)), snapshot_context():
+        if graphql_version < (3, 0):
+            result = graphql.graphql(test_schema, test_source_str)
+        else:
+            result = await graphql.graphql(test_schema, test_source_str)
+        assert result.data == {"hello": "friend"}
+
+
 @pytest.mark.asyncio
 async def test_graphql_error(test_schema, snapshot_context):
     with snapshot_context(ignores=["meta.error.type", "meta.error.msg"]):
@@ -83,6 +106,40 @@ async def test_graphql_error(test_schema, snapshot_context):
         assert "Cannot query field" in result.errors[0].message
 
 
+def _graphql_sync(schema, source):
+    if graphql_version < (3, 0):
+        return graphql.graphql(schema, source)
+    return graphql.graphql_sync(schema, source)
+
+
+def test_graphql_error_msg(test_schema, dummy_tracer):
+    result = _graphql_sync(test_schema, "{ invalid_schema }")
+    assert len(result.errors) == 1
+
+    error_spans = [span for span in dummy_tracer.pop() if span.error]
+    assert error_spans
+    for span in error_spans:
+        assert span.get_tag(ERROR_MSG) == result.errors[0].message
+
+
+def test_graphql_error_msg_full_error_format(test_schema, dummy_tracer):
+    with override_config("graphql", dict(full_error_format=True)):
+        result = _graphql_sync(test_schema, "{ invalid_schema }")
+    assert len(result.errors) == 1
+
+    error_spans = [span for span in dummy_tracer.pop() if span.error]
+    assert error_spans
+    for span in error_spans:
+        assert span.get_tag(ERROR_MSG) == str(result.errors[0])
+        if graphql_version < (3, 0):
+            # str(GraphQLError) is the error message in graphql-core<3
+            assert span.get_tag(ERROR_MSG) == result.errors[0].message
+        else:
+            # str(GraphQLError) includes the source location of the error in graphql-core>=3
+            assert span.get_tag(ERROR_MSG).startswith(result.errors[0].message)
+            assert "GraphQL request:1:3" in span.get_tag(ERROR_MSG)
+
+
 @snapshot(token_override="tests.contrib.graphql.test_graphql.test_graphql")
 @pytest.mark.skipif(graphql_version >= (3, 0), reason="graphql version>=3.0 does not return a promise")
 def test_graphql_v2_promise(test_schema, test_source_str):
@@ -146,3 +203,69 @@ def test_graphql_execute_sync_with_middlware_manager(
         res2 = graphql.execution.execute_sync(test_schema, ast, middleware=middleware_manager)
         assert res1.data == {"hello": "friend"}
         assert res2.data == {"hello": "friend"}
+
+
+def test_graphql_execute_with_middleware_generator(
+    test_schema, test_source_str, enable_graphql_resolvers, dummy_tracer
+):
+    resolved_fields = []
+
+    def recording_middleware(next_middleware, root, info, **args):
+        resolved_fields.append(info.field_name)
+        return next_middleware(root, info, **args)
+
+    ast = graphql.parse(test_source_str)
+    # a generator can only be consumed once, the user middleware must still be called
+    result = graphql.execute(test_schema, ast, middleware=(m for m in [recording_middleware]))
+    assert result.data == {"hello": "friend"}
+    assert resolved_fields == ["hello"]
+
+    resolve_spans = [span for span in dummy_tracer.pop() if span.name == "graphql.resolve"]
+    assert len(resolve_spans) == 1
+
+
+def test_graphql_execute_with_resolver_middleware_already_present(
+    test_schema, test_source_str, enable_graphql_resolvers, dummy_tracer
+):
+    middlewares = [_ResolverMiddleware(Pin.get_from(graphql))]
+    ast = graphql.parse(test_source_str)
+    result = graphql.execute(test_schema, ast, middleware=middlewares)
+    assert result.data == {"hello": "friend"}
+    assert len(middlewares) == 1
+
+    resolve_spans = [span for span in dummy_tracer.pop() if span.name == "graphql.resolve"]
+    assert len(resolve_spans) == 1
+
+
+def test_graphql_unsampled_spans_keep_source(test_schema, test_source_str, dummy_tracer):
+    # spans dropped by a client side sampler are still aggregated by resource when trace stats are computed
+    dummy_tracer.configure(sampler=RateSampler(0), compute_stats_enabled=True)
+    stats_processor = next(p for p in dummy_tracer._span_processors if isinstance(p, SpanStatsProcessorV06))
+    started_spans = []
+    dummy_tracer.on_start_span(started_spans.append)
+
+    try:
+        result = _graphql_sync(test_schema, test_source_str)
+        assert result.data == {"hello": "friend"}
+
+        aggr_resources = {
+            aggr_key[0]: aggr_key[2] for bucket in stats_processor._buckets.values() for aggr_key in bucket
+        }
+    finally:
+        stats_processor.stop()
+        stats_processor.join()
+
+    assert [span.name for span in started_spans] == [
+        "graphql.request",
+        "graphql.parse",
+        "graphql.validate",
+        "graphql.execute",
+    ]
+    for span in started_spans:
+        assert not span.sampled
+    assert started_spans[0].resource == test_source_str
+    assert started_spans[3].resource == test_source_str
+    for span in started_spans[1:]:
+        assert span.get_tag("graphql.source") == test_source_str
+    # the measured graphql.request span is aggregated under the query, not the span name
+    assert aggr_resources["graphql.request"] == test_source_str